@@ -0,0 +1,346 @@
+# JSON-API für Skripte und andere Programme (Start: python api.py)
+# Nutzt dieselben Datenfunktionen wie die Oberfläche, ohne dass für jede Anfrage das ganze Streamlit-Skript läuft.
+# Anmeldung per HTTP Basic Auth mit den Benutzern der App; jede Anfrage sieht nur den Keller ihres Benutzers.
+#
+#   GET   /api/produkte              alle Produkte (gestreamt, eine JSON-Zeile pro Produkt)
+#   GET   /api/buchungen?seit=N      Buchungen mit Buchungsnummer > N (gestreamt, eine JSON-Zeile pro Buchung)
+#   GET   /api/bestand               vorrätige Produkte
+#   GET   /api/inventur              alle Produkte mit Bestand und Wert
+#   GET   /api/uebersicht            Bestand pro Lagerort und monatlicher Konsum/Kauf
+#   POST  /api/produkte              Produkt anlegen (Objekt) oder mehrere Produkte (Liste)
+#   POST  /api/buchungen             Buchung erfassen (Objekt) oder Stapel in einer Transaktion (Liste)
+#   PATCH /api/buchungen/<nummer>    Buchung ändern (nur die angegebenen Felder)
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import bcrypt
+import psycopg2
+import psycopg2.extras
+
+import app
+
+# Zeilen pro Abruf beim Streamen großer Listen
+STREAM_BATCH = 1000
+
+# Erfolgreiche Anmeldungen merken, damit nicht jede Anfrage bcrypt rechnen muss (Sekunden)
+LOGIN_CACHE_SECONDS = 300
+
+# Größe eines Anfrageinhalts begrenzen (Bytes)
+MAX_BODY = 10 * 1024 * 1024
+
+BOOKING_ARTEN = ('Wareneingang', 'Warenausgang')
+BUCHUNGSTYPEN = ('Kauf', 'Konsum', 'Geschenk', 'Entsorgung', 'Umlagerung', 'Inventur', 'Andere')
+PRODUCT_FIELDS = ('weingut', 'rebsorte', 'lage', 'land', 'jahrgang', 'lagerort', 'preis_pro_einheit',
+                  'alko', 'zucker', 'saure', 'info', 'kauf_link', 'comments', 'ean')
+PRODUCT_NUMBERS = {'jahrgang': int, 'alko': float, 'zucker': float, 'saure': float}
+
+login_cache = {}
+login_lock = threading.Lock()
+
+# Fehler mit HTTP-Status, wird als JSON-Antwort ausgegeben
+class ApiError(Exception):
+    def __init__(self, status, message, messages=None):
+        super().__init__(message)
+        self.status = status
+        self.messages = messages or [{'level': 'error', 'text': message}]
+
+# Benutzer prüfen und Keller zurückgeben (None, wenn die Anmeldung fehlschlägt)
+def authenticate(username, password):
+    key = (username, hashlib.sha256(password.encode('utf-8')).hexdigest())
+    with login_lock:
+        cached = login_cache.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    conn = app.get_db_connection(silent=True)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT password, cellar_id FROM users WHERE username = %s', (username,))
+        user = c.fetchone()
+    finally:
+        conn.close()
+
+    if not user or not bcrypt.checkpw(password.encode('utf-8'), user[0].encode('utf-8')):
+        return None
+
+    with login_lock:
+        login_cache[key] = (user[1], time.monotonic() + LOGIN_CACHE_SECONDS)
+    return user[1]
+
+# Eingaben einer Buchung prüfen und in die Parameter von insert_booking umwandeln
+def parse_booking(data):
+    try:
+        booking = {
+            'product_id': int(data['product_id']),
+            'menge': int(data['menge']),
+            'buchungstyp': data['buchungstyp'],
+            'buchungsdatum': date.fromisoformat(data.get('buchungsdatum') or date.today().isoformat()),
+            'booking_art': data['booking_art'],
+            'comments': data.get('comments', ''),
+        }
+        # Einkaufspreis nur für Wareneingänge; ohne Angabe gilt der aktuelle Einzelpreis des Produkts
+        if data.get('einzelpreis') is not None:
+            booking['einzelpreis'] = float(data['einzelpreis'])
+    except KeyError as e:
+        raise ApiError(400, f"Feld {e.args[0]} fehlt")
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, f"Ungültige Buchung: {e}")
+
+    if booking['menge'] <= 0:
+        raise ApiError(400, "Die Menge muss größer als 0 sein")
+    if booking['booking_art'] not in BOOKING_ARTEN:
+        raise ApiError(400, f"booking_art muss einer dieser Werte sein: {', '.join(BOOKING_ARTEN)}")
+    if booking['buchungstyp'] not in BUCHUNGSTYPEN:
+        raise ApiError(400, f"buchungstyp muss einer dieser Werte sein: {', '.join(BUCHUNGSTYPEN)}")
+    return booking
+
+# Eingaben eines Produkts prüfen (fehlende Textfelder wie im Formular leer, fehlende Zahlen leer)
+def parse_product(data):
+    unknown = set(data) - set(PRODUCT_FIELDS)
+    if unknown:
+        raise ApiError(400, f"Unbekannte Felder: {', '.join(sorted(unknown))}")
+    product = {field: str(data.get(field) or '') for field in PRODUCT_FIELDS}
+    try:
+        product['preis_pro_einheit'] = float(data.get('preis_pro_einheit') or 0)
+    except (TypeError, ValueError):
+        raise ApiError(400, "preis_pro_einheit muss eine Zahl sein")
+
+    # Zahlenwerte dürfen fehlen (null oder leer), Komma als Dezimaltrennzeichen ist erlaubt
+    for field, kind in PRODUCT_NUMBERS.items():
+        value = data.get(field)
+        try:
+            product[field] = None if value in (None, '') else kind(str(value).replace(',', '.'))
+        except ValueError:
+            raise ApiError(400, f"{field} muss eine Zahl sein")
+    return product
+
+# Datenfunktion von app.py aufrufen; ihre Meldungen landen in der Antwort statt auf der Seite
+def call(function, *args, **kwargs):
+    app.request_context.messages = []
+    try:
+        result = function(*args, **kwargs)
+        return result, app.request_context.messages
+    finally:
+        app.request_context.messages = None
+
+def records(df):
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = 'WeinlagerAPI/1.0'
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        try:
+            cellar_id, username = self.check_login()
+            app.request_context.cellar_id = cellar_id
+            app.request_context.username = username
+            route = (method, re.sub(r'/\d+$', '/<nummer>', url.path.rstrip('/')))
+            if route not in ROUTES:
+                raise ApiError(404, f"Unbekannter Pfad: {method} {url.path}")
+            ROUTES[route](self, url)
+        except ApiError as e:
+            self.send_json(e.status, {'ok': False, 'meldungen': e.messages})
+        except psycopg2.OperationalError as e:
+            # Die Fehlermeldung nennt Server und Port, sie gehört ins Protokoll und nicht in die Antwort
+            app.logger.warning("Datenbank für die API nicht erreichbar: %s", e)
+            self.send_json(503, {'ok': False, 'meldungen': [{'level': 'error', 'text': "Die Datenbank ist vorübergehend nicht erreichbar."}]})
+        except (BrokenPipeError, ConnectionResetError):
+            # Der Client hat die Verbindung beendet, niemand wartet mehr auf eine Antwort
+            self.close_connection = True
+        except Exception:
+            app.logger.exception("Fehler in der API")
+            self.send_json(500, {'ok': False, 'meldungen': [{'level': 'error', 'text': "Leider ist ein Fehler aufgetreten."}]})
+        finally:
+            app.request_context.cellar_id = None
+            app.request_context.username = None
+
+    def check_login(self):
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Basic '):
+            try:
+                username, _, password = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+            except ValueError:
+                username, password = None, None
+            cellar_id = username and authenticate(username, password)
+            if cellar_id:
+                return cellar_id, username
+        raise ApiError(401, "Anmeldung erforderlich")
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ApiError(413, "Anfrage zu groß")
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except ValueError as e:
+            raise ApiError(400, f"Ungültiges JSON: {e}")
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        if status == 401:
+            self.send_header('WWW-Authenticate', 'Basic realm="Weinlager"')
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Große Listen zeilenweise aus einem serverseitigen Cursor senden (NDJSON), ohne sie komplett zu laden
+    def send_stream(self, query, params):
+        conn = app.get_db_connection(silent=True, cellar_id=app.current_cellar())
+        try:
+            c = conn.cursor(name='api_stream', cursor_factory=psycopg2.extras.RealDictCursor)
+            c.itersize = STREAM_BATCH
+            c.execute(query, params)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+
+            # Ab hier ist die Antwort begonnen: bei Fehlern keine zweite Antwort senden, sondern die Verbindung schließen
+            try:
+                for row in c:
+                    self.wfile.write(json.dumps(row, default=str).encode('utf-8') + b'\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            except Exception:
+                app.logger.exception("Datenstrom der API abgebrochen")
+            self.close_connection = True
+        finally:
+            conn.close()
+
+    def list_products(self, url):
+        self.send_stream('''
+            SELECT product_id, weingut, rebsorte, lage, land, jahrgang, lagerort, bestandsmenge, preis_pro_einheit, gesamtpreis,
+                   alko, zucker, saure, info, kauf_link, comments, ean
+            FROM products
+            WHERE cellar_id = %s
+            ORDER BY product_id
+        ''', (app.current_cellar(),))
+
+    def list_bookings(self, url):
+        try:
+            since = int(parse_qs(url.query).get('seit', ['0'])[0])
+        except ValueError:
+            raise ApiError(400, "seit muss eine Buchungsnummer sein")
+        self.send_stream('''
+            SELECT booking_id, booking_art, product_id, buchungsdatum, menge, buchungstyp, comments, einzelpreis
+            FROM bookings
+            WHERE cellar_id = %s AND booking_id > %s
+            ORDER BY booking_id
+        ''', (app.current_cellar(), since))
+
+    def get_stock(self, url):
+        self.send_json(200, records(app.product_list(in_stock=True)))
+
+    def get_inventory(self, url):
+        self.send_json(200, records(app.product_list()))
+
+    def get_overview(self, url):
+        self.send_json(200, {
+            'lagerorte': records(app.inventory_per_location()),
+            'monate': records(app.monthly_bookings()),
+        })
+
+    def create_products(self, url):
+        data = self.read_json()
+        products = [parse_product(item) for item in (data if isinstance(data, list) else [data])]
+
+        results, messages = [], []
+        for product in products:
+            product_id, product_messages = call(app.register_product, **product)
+            results.append(product_id)
+            messages.extend(product_messages)
+
+        status = 201 if None not in results else (200 if any(results) else 409)
+        if isinstance(data, list):
+            self.send_json(status, {'ok': None not in results, 'product_ids': results, 'meldungen': messages})
+        else:
+            self.send_json(status, {'ok': results[0] is not None, 'product_id': results[0], 'meldungen': messages})
+
+    def create_bookings(self, url):
+        data = self.read_json()
+        if isinstance(data, list):
+            if not data:
+                raise ApiError(400, "Keine Buchungen angegeben")
+            booking_ids, messages = call(app.record_bookings, [parse_booking(item) for item in data])
+            if booking_ids is None:
+                raise ApiError(409, "Stapel nicht gebucht", messages)
+            self.send_json(201, {'ok': True, 'booking_ids': booking_ids, 'meldungen': messages})
+            return
+
+        booking = parse_booking(data or {})
+        record = app.record_incoming_booking if booking['booking_art'] == 'Wareneingang' else app.record_outgoing_booking
+        booking_id, messages = call(record, **booking)
+        if booking_id is None:
+            raise ApiError(409, "Buchung nicht erfasst", messages)
+        self.send_json(201, {'ok': True, 'booking_id': booking_id, 'meldungen': messages})
+
+    def update_booking(self, url):
+        booking_id = int(url.path.rstrip('/').rsplit('/', 1)[1])
+        current = app.query_postgres('''
+            SELECT product_id, menge, buchungstyp, buchungsdatum, booking_art, comments
+            FROM bookings WHERE booking_id = %s AND cellar_id = %s
+        ''', (booking_id, app.current_cellar()))
+        if current.empty:
+            raise ApiError(404, f"Die Buchungsnummer {booking_id} existiert nicht!")
+
+        data = self.read_json() or {}
+        values = current.iloc[0].to_dict()
+        values['buchungsdatum'] = str(values['buchungsdatum'])
+        values.update(data)
+        booking = parse_booking(values)
+        if booking['product_id'] != int(current.iloc[0]['product_id']):
+            raise ApiError(400, "Das Produkt einer Buchung kann nicht geändert werden")
+
+        saved, messages = call(app.adjust_booking, booking_id, booking['menge'], booking['buchungstyp'],
+                               booking['booking_art'], booking['buchungsdatum'], booking['comments'])
+        if not saved:
+            raise ApiError(409, "Buchung nicht geändert", messages)
+        self.send_json(200, {'ok': True, 'booking_id': booking_id, 'meldungen': messages})
+
+ROUTES = {
+    ('GET', '/api/produkte'): ApiHandler.list_products,
+    ('GET', '/api/buchungen'): ApiHandler.list_bookings,
+    ('GET', '/api/bestand'): ApiHandler.get_stock,
+    ('GET', '/api/inventur'): ApiHandler.get_inventory,
+    ('GET', '/api/uebersicht'): ApiHandler.get_overview,
+    ('POST', '/api/produkte'): ApiHandler.create_products,
+    ('POST', '/api/buchungen'): ApiHandler.create_bookings,
+    ('PATCH', '/api/buchungen/<nummer>'): ApiHandler.update_booking,
+}
+
+def main():
+    app.load_dotenv()
+    host = os.getenv('WEINLAGER_API_HOST', '127.0.0.1')
+    port = int(os.getenv('WEINLAGER_API_PORT', '8502'))
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"Weinlager-API auf http://{host}:{port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# Prüft den Kaltstart von app.py gegen das Budget (z.B. vor dem Deploy: python check_startup.py)
+# Gemessen wird in einem frischen Python-Prozess: Import von app.py (ohne Streamlit selbst) und Speicher danach.
+# Außerdem darf keines der schweren Module beim Start schon geladen sein.
+import json
+import subprocess
+import sys
+
+# Budget nur für den Import von app.py; STARTUP_BUDGET_MS in app.py gilt für den ganzen ersten Durchlauf
+IMPORT_BUDGET_MS = 300
+
+# Module, die erst bei Bedarf geladen werden sollen
+HEAVY_MODULES = ('pandas.core.frame', 'numpy.linalg', 'matplotlib.pyplot', 'PIL.Image')
+
+MEASURE = '''
+import json, sys, time
+import streamlit
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    'import_ms': import_ms,
+    'speicher_mb': app.resident_memory_mb(),
+    'budget_mb': app.STARTUP_BUDGET_MB,
+    'geladen': [name for name in %r if name in sys.modules],
+}))
+''' % (HEAVY_MODULES,)
+
+# Mehrere Läufe, der schnellste zählt (Schwankungen durch Plattencache)
+def measure(runs=3):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', MEASURE], capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(results, key=lambda result: result['import_ms'])
+
+def main():
+    result = measure()
+    print(f"Import app.py: {result['import_ms']:.0f} ms (Budget {IMPORT_BUDGET_MS} ms)")
+    print(f"Speicher: {result['speicher_mb']:.0f} MB (Budget {result['budget_mb']} MB)")
+
+    errors = []
+    if result['import_ms'] > IMPORT_BUDGET_MS:
+        errors.append("Startzeit über Budget")
+    if result['speicher_mb'] > result['budget_mb']:
+        errors.append("Speicher über Budget")
+    if result['geladen']:
+        errors.append(f"Beim Start geladen: {', '.join(result['geladen'])}")
+
+    for error in errors:
+        print(f"FEHLER: {error}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())